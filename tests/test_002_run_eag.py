@@ -139,6 +139,25 @@ def test_calculate_fluxes():
     return
 
 
+def test_calculate_fluxes_cached():
+    e = test_eag_run()
+    f1 = e.aggregate_fluxes()
+    f1.columns = [icol.upper() for icol in f1.columns]
+    f2 = e.aggregate_fluxes()
+    assert "neerslag" in f2.columns
+    assert np.allclose(f1, f2, equal_nan=True)
+
+    # simulate again with different parameters, aggregates should change
+    params = pd.read_csv(os.path.join(test_data, "param_1396_3360-EAG-1.csv"),
+                         delimiter=";", decimal=".")
+    params["Waarde"] = pd.to_numeric(params.Waarde)
+    params.loc[params.ParamCode == "hInit", "Waarde"] *= 2.0
+    e.simulate(params=params, tmin="2000", tmax="2000-01-10")
+    f3 = e.aggregate_fluxes()
+    assert not np.allclose(f2["uitspoeling"], f3["uitspoeling"])
+    return
+
+
 def test_calculate_fractions():
     e = test_eag_run()
     _ = e.calculate_fractions()
@@ -28,7 +28,7 @@ def test_add_series_to_gaf():
     return g
 
 
-def test_gaf_run():
+def setup_gaf_run():
     g = test_add_series_to_gaf()
     e, = g.get_eags()
     bm = e.get_buckets(buckettype="MengRiool")
@@ -41,6 +41,32 @@ def test_gaf_run():
                          delimiter=";", decimal=",")
     # params.rename(columns={"ParamCode": "Code"}, inplace=True)
     params["Waarde"] = pd.to_numeric(params.Waarde)
+    return g, params
+
+
+def test_gaf_run():
+    g, params = setup_gaf_run()
     g.simulate(params, tmin="2000", tmax="2000-01-10")
 
     return g
+
+
+def test_gaf_run_parallel():
+    g1 = test_gaf_run()
+
+    g2, params = setup_gaf_run()
+    e, = g2.get_eags()
+    held = e.get_buckets()[0]
+    g2.simulate(params, tmin="2000", tmax="2000-01-10", max_workers=2)
+
+    # results are attached to the original Eag and bucket objects
+    e1, = g1.get_eags()
+    assert g2.get_eags() == [e]
+    assert e.gaf is g2
+    assert e.get_buckets()[0] is held
+    assert not held.fluxes.empty
+    assert all(b.eag is e for b in e.get_buckets() + [e.water])
+    assert np.allclose(e1.water.fluxes, e.water.fluxes, equal_nan=True)
+    assert np.allclose(e1.aggregate_fluxes(), e.aggregate_fluxes(),
+                       equal_nan=True)
+    return g2
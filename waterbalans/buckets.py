@@ -72,10 +72,20 @@ class BucketBase(ABC):
         if self.eag is None:
             return
 
-        if "Neerslag" in self.eag.series.columns:
-            self.series["Neerslag"] = self.eag.series["Neerslag"]
-        if "Verdamping" in self.eag.series.columns:
-            self.series["Verdamping"] = self.eag.series["Verdamping"]
+        cols = [
+            icol
+            for icol in ["Neerslag", "Verdamping"]
+            if icol in self.eag.series.columns
+        ]
+        if len(cols) == 0:
+            return
+
+        # align once and add both series in a single assignment
+        if self.series.index.empty:
+            self.series = self.series.reindex(self.eag.series.index)
+        self.series[cols] = (
+            self.eag.series.loc[:, cols].reindex(self.series.index).to_numpy()
+        )
 
     def simulate(self, params=None, tmin=None, tmax=None, dt=1.0):
         """Calculate the waterbalance for this bucket.
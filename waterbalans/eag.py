@@ -5,7 +5,6 @@ Artesia Water, September 2018
 """
 
 import logging
-from collections import OrderedDict
 from timeit import default_timer as timer
 
 import numpy as np
@@ -13,11 +12,22 @@ import pandas as pd
 from pandas import Timestamp, date_range
 from pandas.tseries.offsets import DateOffset
 
-from .plots import Eag_Plots
 from .timeseries import get_series, update_series
 from .utils import check_numba, njit
 from .wsdl_settings import _wsdl
 
+# names of the water bucket fluxes in the aggregated fluxes
+_aggregated_names = {
+    "Neerslag": "neerslag",
+    "Verdamping": "verdamping",
+    "Qkwel": "kwel",
+    "Qwegz": "wegzijging",
+    "q_oa": "verhard",  # Verhard: q_oa van Verhard bakje
+    "q_in": "berekende inlaat",
+    "q_out": "berekende uitlaat",
+    "q_dr": "drain",
+}
+
 
 class Eag:
     """This class represents an EAG.
@@ -57,7 +67,7 @@ class Eag:
         self.name = name
 
         # Container for all the buckets
-        self.buckets = OrderedDict()
+        self.buckets = {}
         # Eag attribute containing the water bucket
         self.water = None
 
@@ -68,9 +78,16 @@ class Eag:
             self.series = series
 
         self.parameters = pd.DataFrame(columns=["Waarde"])
+        # target level and bottom of the water bucket, set in simulate
+        self._hTarget = None
+        self._hBottom = None
+        # cached result of aggregate_fluxes, reset in simulate
+        self._fluxes_cache = None
+        self._fluxes_cache_src = None
 
-        # Add functionality from other modules
-        self.plot = Eag_Plots(self)
+        # Add functionality from other modules, plots are created on first
+        # access of Eag.plot to avoid importing matplotlib when not needed
+        self._plot = None
 
         # FEWS WSDL:
         self.wsdl = _wsdl
@@ -81,6 +98,14 @@ class Eag:
     def __repr__(self):
         return "<EAG object: {0}>".format(self.name)
 
+    @property
+    def plot(self):
+        if self._plot is None:
+            from .plots import Eag_Plots
+
+            self._plot = Eag_Plots(self)
+        return self._plot
+
     def set_wsdl(self, wsdl):
         self.wsdl = wsdl
 
@@ -425,6 +450,19 @@ class Eag:
                     bucketlist.append(v)
             return bucketlist
 
+    def get_bucket_ids(self):
+        """get the IDs of the buckets in the Eag per bucket type.
+
+        Returns
+        -------
+        bucket_ids : dict
+            dictionary with bucket type as key and list of bucket IDs as value
+        """
+        bucket_ids = {}
+        for idn, bucket in self.buckets.items():
+            bucket_ids.setdefault(bucket.name, []).append(idn)
+        return bucket_ids
+
     def get_parameter_df(self):
         """get parameter dataframe containing parameter values for each bucket.
 
@@ -433,20 +471,19 @@ class Eag:
         df : pandas.DataFrame
             DataFrame containing all parameters in the model
         """
-        df = pd.DataFrame(
-            columns=["Bakje", "BakjeID", "ParamCode", "Laagvolgorde", "Waarde"]
-        )
-        j = 0
+        # collect rows first and build the DataFrame once, growing a
+        # DataFrame row by row copies the full frame for every parameter
+        rows = []
         for b in self.get_buckets() + [self.water]:
             for ipar in b.parameters.index:
                 value = b.parameters.at[ipar, "Waarde"]
                 param, layer = ipar.split("_")
-                df.loc[j, "BakjeID"] = b.idn
-                df.loc[j, "Laagvolgorde"] = layer
-                df.loc[j, "ParamCode"] = param
-                df.loc[j, "Waarde"] = value
-                df.loc[j, "Bakje"] = b.name
-                j += 1
+                rows.append([b.name, b.idn, param, layer, value])
+
+        df = pd.DataFrame(
+            rows,
+            columns=["Bakje", "BakjeID", "ParamCode", "Laagvolgorde", "Waarde"],
+        )
 
         return df
 
@@ -466,6 +503,10 @@ class Eag:
         if self.use_numba:
             self.logger.debug("Using numba methods for simulation.")
 
+        # fluxes will change, so discard the aggregated fluxes
+        self._fluxes_cache = None
+        self._fluxes_cache_src = None
+
         self.parameters = params
         self.parameters.set_index(
             self.parameters.loc[:, "ParamCode"]
@@ -474,21 +515,33 @@ class Eag:
             inplace=True,
         )
 
+        # split parameters per bucket once, instead of scanning the
+        # parameter table for each bucket
+        bucket_params = {
+            idn: df["Waarde"] for idn, df in params.groupby("BakjeID")
+        }
+        no_params = params["Waarde"].iloc[:0]
+
         for idn, bucket in self.buckets.items():
-            p = params.loc[params.loc[:, "BakjeID"] == idn]
+            p = bucket_params.get(idn, no_params)
 
             self.logger.info(
                 "Simulating the waterbalance for bucket: %s %s"
                 % (bucket.name, idn)
             )
-            bucket.simulate(params=p.loc[:, "Waarde"], tmin=tmin, tmax=tmax)
+            bucket.simulate(params=p, tmin=tmin, tmax=tmax)
 
-        p = params.loc[params.loc[:, "BakjeID"] == self.water.idn]
+        p = bucket_params.get(self.water.idn, no_params)
         self.logger.info(
             "Simulating the waterbalance for bucket: %s %s"
             % (self.water.name, self.water.idn)
         )
-        self.water.simulate(params=p.loc[:, "Waarde"], tmin=tmin, tmax=tmax)
+        self.water.simulate(params=p, tmin=tmin, tmax=tmax)
+
+        # store levels used for initial volume in water quality simulation
+        self._hTarget = self.water.parameters.at["hTarget_1", "Waarde"]
+        self._hBottom = self.water.parameters.at["hBottom_1", "Waarde"]
+
         end = timer()
         self.logger.info(
             "Simulation succesfully completed in {0:.1f}s.".format(end - start)
@@ -629,14 +682,7 @@ class Eag:
             return C_series
 
         # Calculate initial mass and concentration
-        hTarget = self.parameters.loc[
-            self.parameters.loc[:, "ParamCode"] == "hTarget", "Waarde"
-        ].values[0]
-        hBottom = self.parameters.loc[
-            self.parameters.loc[:, "ParamCode"] == "hBottom", "Waarde"
-        ].values[0]
-
-        V_init = (hTarget - hBottom) * self.water.area
+        V_init = (self._hTarget - self._hBottom) * self.water.area
         M = C_init * V_init
 
         # Sum of outgoing fluxes from water bucket
@@ -650,20 +696,31 @@ class Eag:
 
         # flux + mass coming in
         flux_in = fluxes.loc[:, incols]
-        mass_in = flux_in.multiply(C_series)
+        flux_in_arr = flux_in.values
+        C_arr = C_series.reindex(index=flux_in.index, columns=incols).values
+        mass_in = pd.DataFrame(
+            index=flux_in.index, columns=incols, data=flux_in_arr * C_arr
+        )
 
         if self.water.storage.sum().iloc[0] == 0:
             self.logger.error("Storage is 0.0, cannot simulate WQ!")
             raise Exception("Storage is 0.0, cannot simulate WQ!")
 
+        # sum the in- and outgoing fluxes per timestep up front, so the
+        # loop only has to deal with the recurrence on the total mass
+        flux_out_arr = flux_out.values
+        M_in = np.einsum(
+            "ij,ij->i", np.nan_to_num(flux_in_arr), np.nan_to_num(C_arr)
+        )
+        V_in = np.nansum(flux_in_arr, axis=1)
+        V_out = np.nansum(flux_out_arr, axis=1)
+        # note storage contains the day before the first timestep
+        storage = self.water.storage.values.squeeze()
+
         if self.use_numba:
             self.logger.debug("Using numba method for WQ simulation.")
-            flux_in_arr = flux_in.fillna(0.0).values
-            flux_out_arr = flux_out.fillna(0.0).values
-            mass_in_arr = mass_in.fillna(0.0).values
-            storage = self.water.storage.values.squeeze()
-            mass_tot, mass_out = self.calc_massbalance(
-                flux_out_arr, flux_in_arr, mass_in_arr, storage, C_init, V_init
+            mass_tot, C_out = self.calc_massbalance(
+                M_in, V_in, V_out, storage, M
             )
 
             mass_tot = pd.Series(
@@ -673,7 +730,9 @@ class Eag:
                 fastpath=True,
             )
             mass_out = pd.DataFrame(
-                index=fluxes.index, columns=outcols, data=mass_out
+                index=fluxes.index,
+                columns=outcols,
+                data=np.nan_to_num(flux_out_arr) * C_out[:, np.newaxis],
             )
             if (mass_tot < 0.0).any():
                 raise RuntimeError(
@@ -681,31 +740,27 @@ class Eag:
                     "gone wrong in the waterquality simulation."
                 )
         else:
-            mass_tot = pd.Series(
-                index=fluxes.index, name="mass_tot", dtype=np.float
-            )
-            mass_out = pd.DataFrame(
-                index=fluxes.index, columns=outcols, dtype=np.float
-            )
-
-            for t in fluxes.index:
+            mass_tot_arr = np.zeros(M_in.shape[0], dtype=np.float64)
+            C_out = np.zeros(M_in.shape[0], dtype=np.float64)
 
-                # mass in
-                M_in = mass_in.loc[t].sum()
+            for i in range(M_in.shape[0]):
 
                 # recalculate concentration after inflow w update storage
-                C_out = (M + M_in) / (
-                    self.water.storage.loc[t - pd.Timedelta(days=1), "storage"]
-                    + flux_in.loc[t].sum()
-                )
+                C_out[i] = (M + M_in[i]) / (storage[i] + V_in[i])
 
                 # mass out based on new concentration
-                mass_out.loc[t] = flux_out.loc[t] * C_out
-                M_out = mass_out.loc[t].sum()
+                M = M + M_in[i] + V_out[i] * C_out[i]
 
-                M = M + M_in + M_out
+                mass_tot_arr[i] = M
 
-                mass_tot.loc[t] = M
+            mass_tot = pd.Series(
+                index=fluxes.index, data=mass_tot_arr, name="mass_tot"
+            )
+            mass_out = pd.DataFrame(
+                index=fluxes.index,
+                columns=outcols,
+                data=flux_out_arr * C_out[:, np.newaxis],
+            )
 
         end = timer()
         self.logger.info(
@@ -716,36 +771,23 @@ class Eag:
 
     @staticmethod
     @njit
-    def calc_massbalance(flux_out, flux_in, mass_in, storage, C_init, V_init):
+    def calc_massbalance(M_in, V_in, V_out, storage, M_init):
         # initialize arrays
-        mass_tot = np.zeros(flux_out.shape[0] + 1, dtype=np.float64)
-        mass_out = np.zeros(flux_out.shape, dtype=np.float64)
-        C_out = np.zeros(flux_out.shape[0], dtype=np.float64)
+        mass_tot = np.zeros(M_in.shape[0] + 1, dtype=np.float64)
+        C_out = np.zeros(M_in.shape[0], dtype=np.float64)
 
-        # starting mass and concentration
-        mass_tot[0] = C_init * V_init
+        # starting mass
+        mass_tot[0] = M_init
 
-        for i in range(flux_out.shape[0]):
+        for i in range(M_in.shape[0]):
 
             # recalculate concentration after inflow w update storage
-            C_out[i] = (mass_tot[i] + np.nansum(mass_in[i])) / (
-                storage[i] + np.nansum(flux_in[i])
-            )
-
-            # calculate mass out with new concentration
-            mass_out[i] = flux_out[i] * C_out[i]
+            C_out[i] = (mass_tot[i] + M_in[i]) / (storage[i] + V_in[i])
 
-            # update total mass after outflow
-            mass_tot[i + 1] = (
-                mass_tot[i] + np.nansum(mass_in[i]) + np.nansum(mass_out[i])
-            )
+            # update total mass after outflow with new concentration
+            mass_tot[i + 1] = mass_tot[i] + M_in[i] + V_out[i] * C_out[i]
 
-            # # concentration should remain same
-            # if C_out[i], mass_tot[i + 1] / storage[i + 1]):
-            #     # C_out[i] = mass_tot[i + 1] / storage[i + 1]
-            #     raise Exception
-
-        return mass_tot, mass_out
+        return mass_tot, C_out
 
     def aggregate_fluxes(self):
         """Method to aggregate fluxes to those used for visualisation in the
@@ -757,83 +799,67 @@ class Eag:
             Pandas DataFrame with the fluxes. The column names denote the
             fluxes.
         """
-        d = {
-            "Neerslag": "neerslag",
-            "Verdamping": "verdamping",
-            "Qkwel": "kwel",
-            "Qwegz": "wegzijging",
-            "q_oa": "verhard",  # Verhard: q_oa van Verhard bakje
-            "q_in": "berekende inlaat",
-            "q_out": "berekende uitlaat",
-            "q_dr": "drain",
-        }
+        # return a copy of the cached result if the fluxes were not replaced,
+        # the cache holds a reference to the fluxes it was computed from
+        if (
+            self._fluxes_cache is not None
+            and self._fluxes_cache_src is self.water.fluxes
+        ):
+            return self._fluxes_cache.copy()
 
-        fluxes = self.water.fluxes.reindex(columns=d.keys())
+        fluxes = self.water.fluxes.reindex(columns=_aggregated_names.keys())
         parsed_cols = fluxes.dropna(how="all", axis=1).columns.tolist()
-        fluxes = fluxes.rename(columns=d)
+        fluxes = fluxes.rename(columns=_aggregated_names)
+
+        # Select and sum the bucket fluxes on the ndarray, this avoids
+        # creating intermediate DataFrames for each selection
+        flux_arr = self.water.fluxes.to_numpy()
+        flux_cols = {
+            icol: i for i, icol in enumerate(self.water.fluxes.columns)
+        }
+
+        def sum_fluxes(names, lower=None, upper=None):
+            idx = [flux_cols[n] for n in names]
+            arr = flux_arr[:, idx]
+            if lower is not None or upper is not None:
+                arr = np.clip(arr, lower, upper)
+            return np.nansum(arr, axis=1)
+
+        bucket_ids = self.get_bucket_ids()
+
+        def get_names(flux, buckettypes):
+            return [
+                flux + "_" + str(idn)
+                for buckettype in buckettypes
+                for idn in bucket_ids.get(buckettype, [])
+            ]
 
         # Verhard: q_oa van alle Verhard bakjes
-        names = [
-            "q_oa_" + str(idn)
-            for idn in self.buckets.keys()
-            if self.buckets[idn].name == "Verhard"
-        ]
-        q_verhard = self.water.fluxes.loc[:, names]
-        fluxes["verhard"] = q_verhard.sum(axis=1)
+        names = get_names("q_oa", ["Verhard"])
+        fluxes["verhard"] = sum_fluxes(names)
 
         # Uitspoeling: alle positieve q_ui fluxes uit alle verhard en onverhard en drain
-        names = [
-            "q_ui_" + str(idn)
-            for idn in self.buckets.keys()
-            if self.buckets[idn].name in ["Verhard", "Onverhard"]
-        ]
-        q_uitspoel = self.water.fluxes.loc[:, names]
-        q_uitspoel[q_uitspoel < 0] = 0
-        fluxes["uitspoeling"] = q_uitspoel.sum(axis=1)
+        names = get_names("q_ui", ["Verhard", "Onverhard"])
+        fluxes["uitspoeling"] = sum_fluxes(names, lower=0.0)
 
         # Intrek: alle negatieve q_ui fluxes uit alle bakjes behalve MengRiool
-        names = [
-            "q_ui_" + str(idn)
-            for idn in self.buckets.keys()
-            if self.buckets[idn].name != "MengRiool"
-        ]
-        q_intrek = self.water.fluxes.loc[:, names]
-        q_intrek[q_intrek > 0] = 0
-        fluxes["intrek"] = q_intrek.sum(axis=1)
+        names = get_names(
+            "q_ui", [b for b in bucket_ids if b != "MengRiool"]
+        )
+        fluxes["intrek"] = sum_fluxes(names, upper=0.0)
 
         # Oppervlakkige afstroming: q_oa van Onverharde en Drain bakjes
-        names = [
-            "q_oa_" + str(idn)
-            for idn in self.buckets.keys()
-            if self.buckets[idn].name in ["Onverhard", "Drain"]
-        ]
-        q_afstroom = self.water.fluxes.loc[:, names]
-        fluxes["afstroming"] = q_afstroom.sum(axis=1)
+        names = get_names("q_oa", ["Onverhard", "Drain"])
+        fluxes["afstroming"] = sum_fluxes(names)
 
         # Combined Sewer Overflow: q_cso van MengRiool bakjes
-        names = [
-            "q_cso_" + str(idn)
-            for idn in self.buckets.keys()
-            if self.buckets[idn].name == "MengRiool"
-        ]
-        q_cso = self.water.fluxes.loc[:, names]
-        fluxes["q_cso"] = q_cso.sum(axis=1)
+        names = get_names("q_cso", ["MengRiool"])
+        fluxes["q_cso"] = sum_fluxes(names)
 
         # Gedraineerd: q_oa - positieve q_ui van Drain
-        names = [
-            "q_dr_" + str(idn)
-            for idn in self.buckets.keys()
-            if self.buckets[idn].name == "Drain"
-        ]
-        names2 = [
-            "q_ui_" + str(idn)
-            for idn in self.buckets.keys()
-            if self.buckets[idn].name == "Drain"
-        ]
-        q_drain = self.water.fluxes.loc[:, names]
-        q_uitspoeling = self.water.fluxes.loc[:, names2]
-        q_uitspoeling[q_uitspoeling < 0.0] = 0.0
-        fluxes["drain"] = q_drain.sum(axis=1) + q_uitspoeling.sum(axis=1)
+        names = get_names("q_dr", ["Drain"])
+        names2 = get_names("q_ui", ["Drain"])
+        fluxes["drain"] = sum_fluxes(names) + sum_fluxes(names2, lower=0.0)
 
         # Berekende in en uitlaat
         fluxes["berekende inlaat"] = self.water.fluxes["q_in"]
@@ -848,7 +874,10 @@ class Eag:
         for icol in missed_cols:
             fluxes[icol.lower()] = self.water.fluxes[icol]
 
-        return fluxes
+        self._fluxes_cache = fluxes
+        self._fluxes_cache_src = self.water.fluxes
+
+        return fluxes.copy()
 
     def aggregate_fluxes_w_pumpstation(self):
         fluxes = self.aggregate_fluxes()
@@ -968,50 +997,39 @@ class Eag:
                 data=fractions,
             )
         else:
-            fractions = pd.DataFrame(
-                index=fluxes.index, columns=fraction_columns
+            storage = self.water.storage.values.squeeze()
+            influxes = fluxes.loc[:, fraction_columns].values
+            outflux_arr = outflux.values
+
+            # add day before for initial fractions,
+            # add extra column for 'initial' fraction
+            fractions = np.zeros(
+                (influxes.shape[0] + 1, influxes.shape[1] + 1),
+                dtype=np.float64,
             )
-            # add starting day
-            fractions.loc[
-                fluxes.index[0] - pd.Timedelta(days=1), fraction_columns
-            ] = 0.0
-            # add starting day
-            fractions.loc[
-                fluxes.index[0] - pd.Timedelta(days=1), "initial"
-            ] = 1.0
-            fractions.sort_index(inplace=True)
-
-            for t in fluxes.index:
-                tminus1 = t - pd.Timedelta(days=1)
+            # set initial to 1.0
+            fractions[0, 0] = 1.0
+
+            # note storage and fractions arrays are 1 larger than fluxes
+            for i in range(1, influxes.shape[0] + 1):
+                influx_sum = np.nansum(influxes[i - 1])
                 # influx is smaller than storage
-                if (
-                    fluxes.loc[t, fraction_columns].sum()
-                    <= self.water.storage.loc[t, "storage"]
-                ):
-                    fractions.loc[t, "initial"] = (
-                        fractions.loc[tminus1, "initial"]
-                        * (
-                            self.water.storage.loc[tminus1, "storage"]
-                            + outflux.loc[t]
-                        )
-                    ) / self.water.storage.loc[t, "storage"]
-
-                    for icol in fraction_columns:
-                        fractions.loc[t, icol] = (
-                            fractions.loc[tminus1, icol]
-                            * (
-                                self.water.storage.loc[tminus1, "storage"]
-                                + outflux.loc[t]
-                            )
-                            + fluxes.loc[t, icol]
-                        ) / self.water.storage.loc[t, "storage"]
+                if influx_sum <= storage[i]:
+                    factor = storage[i - 1] + outflux_arr[i - 1]
+                    fractions[i, 0] = fractions[i - 1, 0] * factor / storage[i]
+                    fractions[i, 1:] = (
+                        fractions[i - 1, 1:] * factor + influxes[i - 1]
+                    ) / storage[i]
                 # influx is larger than storage
                 else:
-                    fractions.loc[t, "initial"] = 0.0
-                    fractions.loc[t, fraction_columns] = (
-                        fluxes.loc[t, fraction_columns]
-                        / fluxes.loc[t, fraction_columns].sum()
-                    )
+                    fractions[i, 0] = 0.0
+                    fractions[i, 1:] = influxes[i - 1] / influx_sum
+
+            fractions = pd.DataFrame(
+                index=self.water.storage.index,
+                columns=["initial"] + fraction_columns.tolist(),
+                data=fractions,
+            )
         return fractions
 
     @staticmethod
@@ -1087,7 +1105,7 @@ class Eag:
             self.series.loc[:, gemaal_cols].sum(axis=1)
             - -1 * fluxes["berekende uitlaat"]
         )
-        diff.loc[diff <= 0.0] = 0.0
+        diff = diff.clip(lower=0.0)
 
         inlaat_monthly = diff.resample("M").mean()
         inlaat_sluitfout = inlaat_monthly.resample("D").bfill()
@@ -1,6 +1,6 @@
 """This file contains the polder class."""
 import logging
-from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
@@ -30,7 +30,7 @@ class Gaf:
         self.name = name
 
         # EAG
-        self.eags = OrderedDict()
+        self.eags = {}
 
         if eags is not None:
             for e in eags:
@@ -138,18 +138,80 @@ class Gaf:
                 )
             )
 
-        self.series.loc[
-            series.index.intersection(self.series.index), name
-        ] = series.loc[
-            series.index.intersection(self.series.index)
+        shared_index = series.index.intersection(self.series.index)
+        self.series.loc[shared_index, name] = series.loc[
+            shared_index
         ].values.squeeze()
 
-    def simulate(self, parameters, tmin=None, tmax=None):
-        """Method to calculate the waterbalance for the Gaf."""
-        for eagname, eag in self.eags.items():
-            eag.get_series_from_gaf()
-            params = parameters.loc[parameters.EAGCode == eagname, :]
-            eag.simulate(params, tmin=tmin, tmax=tmax)
+    def simulate(self, parameters, tmin=None, tmax=None, max_workers=None):
+        """Method to calculate the waterbalance for the Gaf.
+
+        Parameters
+        ----------
+        parameters: pandas.DataFrame
+            DataFrame with the parameters for all Eags in the Gaf.
+        tmin: str or pandas.Timestamp, optional
+        tmax: str or pandas.Timestamp, optional
+        max_workers: int, optional
+            number of processes used to simulate the Eags in parallel. By
+            default (None) the Eags are simulated one after the other.
+
+        Notes
+        -----
+        When the Eags are simulated in parallel, the state of the simulated
+        copies returned by the worker processes is copied onto the existing
+        Eag and bucket objects.
+        """
+        if max_workers is None or max_workers == 1:
+            for eagname, eag in self.eags.items():
+                eag.get_series_from_gaf()
+                params = parameters.loc[parameters.EAGCode == eagname, :]
+                eag.simulate(params, tmin=tmin, tmax=tmax)
+            return
+
+        try:
+            # do not send the Gaf (and with it all other Eags) to each
+            # worker, the reference is restored once the simulations are done
+            for eag in self.eags.values():
+                eag.get_series_from_gaf()
+                eag.gaf = None
+
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {}
+                for eagname, eag in self.eags.items():
+                    params = parameters.loc[parameters.EAGCode == eagname, :]
+                    futures[eagname] = executor.submit(
+                        _simulate_eag, eag, params, tmin, tmax
+                    )
+                for eagname, future in futures.items():
+                    _attach_simulated_state(
+                        self.eags[eagname], future.result()
+                    )
+        finally:
+            for eag in self.eags.values():
+                eag.gaf = self
 
     def get_eags(self):
         return [e for e in self.eags.values()]
+
+
+def _simulate_eag(eag, params, tmin=None, tmax=None):
+    """Simulate a single Eag, used by Gaf.simulate in worker processes."""
+    eag.simulate(params, tmin=tmin, tmax=tmax)
+    return eag
+
+
+def _attach_simulated_state(eag, simulated):
+    """Copy the state of an Eag simulated in a worker process onto the
+    original Eag and its buckets, so existing references see the results."""
+    for idn, bucket in eag.buckets.items():
+        bucket.__dict__.update(simulated.buckets[idn].__dict__)
+        bucket.eag = eag
+    eag.water.__dict__.update(simulated.water.__dict__)
+    eag.water.eag = eag
+
+    # keep the original bucket objects, Gaf and plots on the Eag
+    keep = ["buckets", "water", "gaf", "_plot"]
+    eag.__dict__.update(
+        {k: v for k, v in simulated.__dict__.items() if k not in keep}
+    )